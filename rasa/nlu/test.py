@@ -3,6 +3,7 @@ import os
 import logging
 import numpy as np
 from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 from typing import (
     Iterable,
@@ -32,12 +33,29 @@ from rasa.nlu.tokenizers import Token
 
 logger = logging.getLogger(__name__)
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 PRETRAINED_EXTRACTORS = {"DucklingHTTPExtractor", "SpacyEntityExtractor"}
 
 ENTITY_PROCESSORS = {"EntitySynonymMapper"}
 
 CVEvaluationResult = namedtuple("Results", "train test")
 
+FoldResult = namedtuple(
+    "FoldResult",
+    "intent_train_metrics "
+    "intent_test_metrics "
+    "entity_train_metrics "
+    "entity_test_metrics "
+    "intent_test_results "
+    "entity_test_results "
+    "extractors "
+    "intent_classifier_present",
+)
+
 IntentEvaluationResult = namedtuple(
     "IntentEvaluationResult",
     "intent_target " "intent_prediction " "message " "confidence",
@@ -47,6 +65,10 @@ EntityEvaluationResult = namedtuple(
     "EntityEvaluationResult", "entity_targets " "entity_predictions " "tokens"
 )
 
+AlignedPredictions = namedtuple("AlignedPredictions", "target_labels extractor_labels")
+
+TokenBatch = namedtuple("TokenBatch", "starts lens texts")
+
 IntentMetrics = Dict[Text, List[float]]
 EntityMetrics = Dict[Text, Dict[Text, List[float]]]
 
@@ -372,19 +394,20 @@ def evaluate_intents(
 
 
 def merge_labels(
-    aligned_predictions: List[Dict], extractor: Optional[Text] = None
-) -> np.array:
+    aligned_predictions: List[AlignedPredictions], extractor: Optional[Text] = None
+) -> np.ndarray:
     """Concatenates all labels of the aligned predictions.
     Takes the aligned prediction labels which are grouped for each message
     and concatenates them."""
 
     if extractor:
-        label_lists = [ap["extractor_labels"][extractor] for ap in aligned_predictions]
+        label_arrays = [ap.extractor_labels[extractor] for ap in aligned_predictions]
     else:
-        label_lists = [ap["target_labels"] for ap in aligned_predictions]
+        label_arrays = [ap.target_labels for ap in aligned_predictions]
 
-    flattened = list(itertools.chain(*label_lists))
-    return np.array(flattened)
+    if not label_arrays:
+        return np.array([])
+    return np.concatenate(label_arrays)
 
 
 def substitute_labels(labels: List[Text], old: Text, new: Text) -> List[Text]:
@@ -453,12 +476,50 @@ def does_token_cross_borders(token: Token, entity: Dict) -> bool:
     return 0 < num_intersect < len(token.text)
 
 
+def determine_intersection_batch(batch: TokenBatch, entity: Dict) -> np.ndarray:
+    """Calculates how many characters each token of the batch shares with
+    the given entity."""
+
+    token_ends = batch.starts + batch.lens
+    return np.maximum(
+        0,
+        np.minimum(token_ends, np.int32(entity["end"]))
+        - np.maximum(batch.starts, np.int32(entity["start"])),
+    )
+
+
+def _intersection(t_start: int, t_end: int, e_start: int, e_end: int) -> int:
+    """Number of characters two [start, end) character spans share."""
+
+    shared = min(t_end, e_end) - max(t_start, e_start)
+    return shared if shared > 0 else 0
+
+
+if njit is not None:
+    _intersection = njit(cache=True)(_intersection)
+
+
 def determine_intersection(token: Token, entity: Dict) -> int:
     """Calculates how many characters a given token and entity share."""
 
-    pos_token = set(range(token.offset, token.end))
-    pos_entity = set(range(entity["start"], entity["end"]))
-    return len(pos_token.intersection(pos_entity))
+    return _intersection(token.offset, token.end, entity["start"], entity["end"])
+
+
+def _conflicting_spans(
+    starts: np.ndarray, ends: np.ndarray, labels: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Finds overlaps between spans of different labels.
+
+    Returns the start-sorted order of the spans and a boolean mask that
+    marks every span whose successor in that order crosses its end
+    boundary while carrying a different label."""
+
+    order = starts.argsort(kind="stable")
+
+    # a span can only overlap its successor in start order
+    overlaps = ends[order][:-1] > starts[order][1:]
+    conflicts = overlaps & (labels[order][:-1] != labels[order][1:])
+    return order, conflicts
 
 
 def do_entities_overlap(entities: List[Dict]) -> bool:
@@ -468,18 +529,24 @@ def do_entities_overlap(entities: List[Dict]) -> bool:
     :return: boolean
     """
 
-    sorted_entities = sorted(entities, key=lambda e: e["start"])
-    for i in range(len(sorted_entities) - 1):
-        curr_ent = sorted_entities[i]
-        next_ent = sorted_entities[i + 1]
-        if (
-            next_ent["start"] < curr_ent["end"]
-            and next_ent["entity"] != curr_ent["entity"]
-        ):
-            logger.warn("Overlapping entity {} with {}".format(curr_ent, next_ent))
-            return True
+    if len(entities) < 2:
+        return False
 
-    return False
+    starts = np.fromiter(
+        (e["start"] for e in entities), dtype=np.int32, count=len(entities)
+    )
+    ends = np.fromiter((e["end"] for e in entities), dtype=np.int32, count=len(entities))
+    labels = np.array([e["entity"] for e in entities])
+
+    order, conflicts = _conflicting_spans(starts, ends, labels)
+    if not conflicts.any():
+        return False
+
+    first_conflict = int(np.argmax(conflicts))
+    curr_ent = entities[order[first_conflict]]
+    next_ent = entities[order[first_conflict + 1]]
+    logger.warn("Overlapping entity {} with {}".format(curr_ent, next_ent))
+    return True
 
 
 def find_intersecting_entites(token: Token, entities: List[Dict]) -> List[Dict]:
@@ -547,49 +614,132 @@ def do_extractors_support_overlap(extractors: Optional[Set[Text]]) -> bool:
     return CRFEntityExtractor.name not in extractors
 
 
+def _token_boundaries(tokens: List[Token]) -> Tuple[np.ndarray, np.ndarray]:
+    """Collects the token start and end offsets into two int32 arrays."""
+
+    starts = np.fromiter((t.offset for t in tokens), dtype=np.int32, count=len(tokens))
+    ends = np.fromiter((t.end for t in tokens), dtype=np.int32, count=len(tokens))
+    return starts, ends
+
+
+def _entity_prediction_array(entity_predictions: List[Dict]) -> np.ndarray:
+    """Packs entity predictions into a numpy structured array.
+
+    The array keeps the span boundaries, extractor name and entity label
+    of each prediction in columnar fields, so partitioning by extractor
+    becomes a single vectorized mask instead of a Python filter."""
+
+    extractor_width = max((len(p["extractor"]) for p in entity_predictions), default=1)
+    entity_width = max((len(p["entity"]) for p in entity_predictions), default=1)
+
+    return np.array(
+        [
+            (p["start"], p["end"], p["extractor"], p["entity"])
+            for p in entity_predictions
+        ],
+        dtype=[
+            ("start", "i4"),
+            ("end", "i4"),
+            ("extractor", "U{}".format(extractor_width)),
+            ("entity", "U{}".format(entity_width)),
+        ],
+    )
+
+
+def determine_token_labels_batch(
+    token_starts: np.ndarray,
+    token_ends: np.ndarray,
+    entities: Union[List[Dict], np.ndarray],
+    extractors: Optional[Set[Text]],
+) -> List[Text]:
+    """Determines the labels for a whole batch of tokens at once.
+
+    Vectorized equivalent of calling `determine_token_labels` per token:
+    the token/entity character overlaps are computed as a single numpy
+    matrix and each token is assigned the entity it overlaps most with,
+    or "O" if it overlaps none.
+
+    `entities` is either a list of entity dicts or a structured array as
+    built by `_entity_prediction_array`.
+    """
+
+    if len(entities) == 0:
+        return ["O"] * len(token_starts)
+
+    if isinstance(entities, np.ndarray):
+        entity_starts = entities["start"]
+        entity_ends = entities["end"]
+        entity_labels = entities["entity"]
+    else:
+        entity_starts = np.fromiter(
+            (e["start"] for e in entities), dtype=np.int32, count=len(entities)
+        )
+        entity_ends = np.fromiter(
+            (e["end"] for e in entities), dtype=np.int32, count=len(entities)
+        )
+        entity_labels = np.array([e["entity"] for e in entities])
+
+    if not do_extractors_support_overlap(extractors):
+        _, conflicts = _conflicting_spans(entity_starts, entity_ends, entity_labels)
+        if conflicts.any():
+            raise ValueError("The possible entities should not overlap")
+
+    overlap = np.maximum(
+        0,
+        np.minimum(token_ends[:, None], entity_ends[None, :])
+        - np.maximum(token_starts[:, None], entity_starts[None, :]),
+    )
+    best_fit = overlap.argmax(axis=1)
+
+    return [
+        "O" if overlap[i, j] == 0 else entity_labels[j]
+        for i, j in enumerate(best_fit)
+    ]
+
+
 def align_entity_predictions(
     result: EntityEvaluationResult, extractors: Set[Text]
-) -> Dict:
+) -> AlignedPredictions:
     """Aligns entity predictions to the message tokens.
     Determines for every token the true label based on the
     prediction targets and the label assigned by each
     single extractor.
     :param result: entity prediction result
     :param extractors: the entity extractors that should be considered
-    :return: dictionary containing the true token labels and token labels
-             from the extractors
+    :return: AlignedPredictions with the true token labels and the token
+             labels from the extractors as numpy arrays
     """
 
-    true_token_labels = []
-    entities_by_extractors = {
-        extractor: [] for extractor in extractors
-    }  # type: Dict[Text, List]
-    for p in result.entity_predictions:
-        entities_by_extractors[p["extractor"]].append(p)
-    extractor_labels = {
-        extractor: [] for extractor in extractors
-    }  # type: Dict[Text, List]
-    for t in result.tokens:
-        true_token_labels.append(determine_token_labels(t, result.entity_targets, None))
-        for extractor, entities in entities_by_extractors.items():
-            extracted = determine_token_labels(t, entities, set([extractor]))
-            extractor_labels[extractor].append(extracted)
+    predictions = _entity_prediction_array(result.entity_predictions)
 
-    return {
-        "target_labels": true_token_labels,
-        "extractor_labels": dict(extractor_labels),
+    token_starts, token_ends = _token_boundaries(result.tokens)
+    true_token_labels = determine_token_labels_batch(
+        token_starts, token_ends, result.entity_targets, None
+    )
+    extractor_labels = {
+        extractor: np.array(
+            determine_token_labels_batch(
+                token_starts,
+                token_ends,
+                predictions[predictions["extractor"] == extractor],
+                {extractor},
+            )
+        )
+        for extractor in extractors
     }
 
+    return AlignedPredictions(np.array(true_token_labels), extractor_labels)
+
 
 def align_all_entity_predictions(
     entity_results: List[EntityEvaluationResult], extractors: Set[Text]
-) -> List[Dict]:
+) -> List[AlignedPredictions]:
     """ Aligns entity predictions to the message tokens for the whole dataset
         using align_entity_predictions
     :param entity_results: list of entity prediction results
     :param extractors: the entity extractors that should be considered
-    :return: list of dictionaries containing the true token labels and token
-             labels from the extractors
+    :return: list of AlignedPredictions with the true token labels and the
+             token labels from the extractors
     """
     aligned_predictions = []
     for result in entity_results:
@@ -735,16 +885,26 @@ def run_evaluation(
 
 
 def generate_folds(
-    n: int, td: TrainingData
+    n: int, td: TrainingData, stratified: bool = True
 ) -> Iterator[Tuple[TrainingData, TrainingData]]:
-    """Generates n cross validation folds for training data td."""
+    """Generates n cross validation folds for training data td.
+
+    If `stratified` is set, the folds preserve the intent distribution
+    of the training data, which gives lower variance estimates than
+    plain shuffled folds."""
 
-    from sklearn.model_selection import StratifiedKFold
+    from sklearn.model_selection import KFold, StratifiedKFold
 
-    skf = StratifiedKFold(n_splits=n, shuffle=True)
     x = td.intent_examples
-    y = [example.get("intent") for example in x]
-    for i_fold, (train_index, test_index) in enumerate(skf.split(x, y)):
+    if stratified:
+        skf = StratifiedKFold(n_splits=n, shuffle=True)
+        y = [example.get("intent") for example in x]
+        splits = skf.split(x, y)
+    else:
+        kf = KFold(n_splits=n, shuffle=True)
+        splits = kf.split(x)
+
+    for i_fold, (train_index, test_index) in enumerate(splits):
         logger.debug("Fold: {}".format(i_fold))
         train = [x[i] for i in train_index]
         test = [x[i] for i in test_index]
@@ -799,6 +959,93 @@ def combine_result(
     return intent_metrics, entity_metrics
 
 
+def _fold_cache_file(
+    cache_dir: Text,
+    train: TrainingData,
+    test: TrainingData,
+    nlu_config: RasaNLUModelConfig,
+) -> Text:
+    """Computes the cache file path for a cross validation fold.
+
+    The key covers the exact fold split and the pipeline configuration,
+    so a cached result is only reused for an identical fold run."""
+    import hashlib
+
+    key = hashlib.sha1()
+    key.update(train.as_json().encode("utf-8"))
+    key.update(test.as_json().encode("utf-8"))
+    key.update(repr(sorted(nlu_config.as_dict().items())).encode("utf-8"))
+    return os.path.join(cache_dir, key.hexdigest() + ".pkl")
+
+
+def _cross_validate_fold(
+    train: TrainingData,
+    test: TrainingData,
+    nlu_config: RasaNLUModelConfig,
+    fold_cache_dir: Optional[Text] = None,
+) -> FoldResult:
+    """Trains and evaluates a single cross validation fold.
+
+    Defined at module level so that `cross_validate` can dispatch folds
+    to worker processes. Only returns plain data structures so that the
+    result can be sent back across the process boundary.
+
+    If `fold_cache_dir` is set, the fold result is memoized on disk and
+    an identical fold run returns the stored result instead of training."""
+    import pickle
+
+    cache_file = None
+    if fold_cache_dir:
+        cache_file = _fold_cache_file(fold_cache_dir, train, test, nlu_config)
+        if os.path.exists(cache_file):
+            logger.debug("Loading cached fold result from '{}'.".format(cache_file))
+            with open(cache_file, "rb") as f:
+                return pickle.load(f)
+
+    trainer = Trainer(nlu_config)
+    trainer.pipeline = remove_pretrained_extractors(trainer.pipeline)
+
+    intent_train_metrics = defaultdict(list)  # type: IntentMetrics
+    intent_test_metrics = defaultdict(list)  # type: IntentMetrics
+    entity_train_metrics = defaultdict(lambda: defaultdict(list))  # type: EntityMetrics
+    entity_test_metrics = defaultdict(lambda: defaultdict(list))  # type: EntityMetrics
+
+    intent_test_results = []  # type: List[IntentEvaluationResult]
+    entity_test_results = []  # type: List[EntityEvaluationResult]
+
+    interpreter = trainer.train(train)
+
+    # calculate train accuracy
+    combine_result(intent_train_metrics, entity_train_metrics, interpreter, train)
+    # calculate test accuracy
+    combine_result(
+        intent_test_metrics,
+        entity_test_metrics,
+        interpreter,
+        test,
+        intent_test_results,
+        entity_test_results,
+    )
+
+    fold_result = FoldResult(
+        dict(intent_train_metrics),
+        dict(intent_test_metrics),
+        {extractor: dict(m) for extractor, m in entity_train_metrics.items()},
+        {extractor: dict(m) for extractor, m in entity_test_metrics.items()},
+        intent_test_results,
+        entity_test_results,
+        get_entity_extractors(interpreter),
+        is_intent_classifier_present(interpreter),
+    )
+
+    if cache_file:
+        io_utils.create_directory(fold_cache_dir)
+        with open(cache_file, "wb") as f:
+            pickle.dump(fold_result, f)
+
+    return fold_result
+
+
 def cross_validate(
     data: TrainingData,
     n_folds: int,
@@ -808,9 +1055,14 @@ def cross_validate(
     errors: Optional[Text] = "errors.json",
     confmat: Optional[Text] = None,
     histogram: Optional[Text] = None,
+    fold_cache_dir: Optional[Text] = None,
+    stratified: bool = True,
 ) -> Tuple[CVEvaluationResult, CVEvaluationResult]:
     """Stratified cross validation on data.
 
+    The folds are independent of each other, hence they are trained and
+    evaluated in parallel worker processes.
+
     Args:
         data: Training Data
         n_folds: integer, number of cv folds
@@ -820,12 +1072,14 @@ def cross_validate(
         errors: path to file that will contain error cases
         confmat: path to file that will show the confusion matrix
         histogram: path fo file that will show a histogram
+        fold_cache_dir: path to folder where fold results are memoized,
+            repeated runs on identical folds reuse the stored results
+        stratified: whether folds should preserve the intent distribution
 
     Returns:
         dictionary with key, list structure, where each entry in list
               corresponds to the relevant result for one fold
     """
-    from collections import defaultdict
 
     if isinstance(nlu_config, str):
         nlu_config = config.load(nlu_config)
@@ -833,9 +1087,6 @@ def cross_validate(
     if report:
         io_utils.create_directory(report)
 
-    trainer = Trainer(nlu_config)
-    trainer.pipeline = remove_pretrained_extractors(trainer.pipeline)
-
     intent_train_metrics = defaultdict(list)  # type: IntentMetrics
     intent_test_metrics = defaultdict(list)  # type: IntentMetrics
     entity_train_metrics = defaultdict(lambda: defaultdict(list))  # type: EntityMetrics
@@ -846,25 +1097,37 @@ def cross_validate(
     intent_classifier_present = False
     extractors = set()  # type: Set[Text]
 
-    for train, test in generate_folds(n_folds, data):
-        interpreter = trainer.train(train)
-
-        # calculate train accuracy
-        combine_result(intent_train_metrics, entity_train_metrics, interpreter, train)
-        # calculate test accuracy
-        combine_result(
-            intent_test_metrics,
-            entity_test_metrics,
-            interpreter,
-            test,
-            intent_test_results,
-            entity_test_results,
+    folds = list(generate_folds(n_folds, data, stratified))
+    with ProcessPoolExecutor() as executor:
+        fold_results = list(
+            executor.map(
+                _cross_validate_fold,
+                [train for train, _ in folds],
+                [test for _, test in folds],
+                itertools.repeat(nlu_config),
+                itertools.repeat(fold_cache_dir),
+            )
         )
 
+    for fold_result in fold_results:
+        for k, v in fold_result.intent_train_metrics.items():
+            intent_train_metrics[k] += v
+        for k, v in fold_result.intent_test_metrics.items():
+            intent_test_metrics[k] += v
+        for extractor, extractor_metric in fold_result.entity_train_metrics.items():
+            for k, v in extractor_metric.items():
+                entity_train_metrics[extractor][k] += v
+        for extractor, extractor_metric in fold_result.entity_test_metrics.items():
+            for k, v in extractor_metric.items():
+                entity_test_metrics[extractor][k] += v
+
+        intent_test_results += fold_result.intent_test_results
+        entity_test_results += fold_result.entity_test_results
+
         if not extractors:
-            extractors = get_entity_extractors(interpreter)
+            extractors = fold_result.extractors
 
-        if is_intent_classifier_present(interpreter):
+        if fold_result.intent_classifier_present:
             intent_classifier_present = True
 
     if intent_classifier_present:
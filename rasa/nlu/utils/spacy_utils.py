@@ -9,6 +9,10 @@ from rasa.nlu.model import InvalidModelError
 
 logger = logging.getLogger(__name__)
 
+# spacy models are large, so they are shared between all `SpacyNLP`
+# components of the process, keyed by model name
+_SPACY_MODEL_CACHE = {}  # type: Dict[Text, Any]
+
 if typing.TYPE_CHECKING:
     from spacy.language import Language
     from spacy.tokens.doc import Doc  # pytype: disable=import-error
@@ -40,11 +44,19 @@ class SpacyNLP(Component):
 
     @staticmethod
     def load_model(spacy_model_name: Text) -> "Language":
-        """Try loading the model, catching the OSError if missing."""
+        """Try loading the model, catching the OSError if missing.
+
+        Loaded models are memoized by name, so pipelines created in the
+        same process share one instance per spacy model."""
         import spacy
 
+        if spacy_model_name in _SPACY_MODEL_CACHE:
+            return _SPACY_MODEL_CACHE[spacy_model_name]
+
         try:
-            return spacy.load(spacy_model_name, disable=["parser"])
+            nlp = spacy.load(spacy_model_name, disable=["parser"])
+            _SPACY_MODEL_CACHE[spacy_model_name] = nlp
+            return nlp
         except OSError:
             raise InvalidModelError(
                 "Model '{}' is not a linked spaCy model.  "
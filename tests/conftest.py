@@ -51,6 +51,9 @@ async def default_agent(tmpdir_factory) -> Agent:
 
 @pytest.fixture(scope="session")
 async def trained_moodbot_path():
+    # trains into the persistent MOODBOT_MODEL_PATH, so repeated test
+    # sessions reuse the stored model via the fingerprint check in
+    # `train_async` instead of retraining
     return await train_async(
         domain="examples/moodbot/domain.yml",
         config="examples/moodbot/config.yml",
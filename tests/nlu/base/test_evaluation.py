@@ -1,16 +1,19 @@
 # coding=utf-8
 import asyncio
-import logging
+import hashlib
+import pickle
 
 import pytest
 
+import numpy as np
+
 import rasa.utils.io
 from rasa.test import compare_nlu_models
+from rasa.nlu.components import Component
 from rasa.nlu.extractors import EntityExtractor
-from rasa.nlu.extractors.mitie_entity_extractor import MitieEntityExtractor
-from rasa.nlu.extractors.spacy_entity_extractor import SpacyEntityExtractor
 from rasa.nlu.model import Interpreter
 from rasa.nlu.test import (
+    AlignedPredictions,
     is_token_within_entity,
     do_entities_overlap,
     merge_labels,
@@ -28,13 +31,20 @@ from rasa.nlu.test import (
 )
 from rasa.nlu.test import does_token_cross_borders
 from rasa.nlu.test import align_entity_predictions
+from rasa.nlu.test import TokenBatch
 from rasa.nlu.test import determine_intersection
+from rasa.nlu.test import determine_intersection_batch
 from rasa.nlu.test import determine_token_labels
 from rasa.nlu.config import RasaNLUModelConfig
 from rasa.nlu.tokenizers import Token
 from rasa.nlu import utils
-import json
 import os
+
+try:
+    # orjson parses in C and works directly on the raw bytes
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 from rasa.nlu import training_data, config
 from tests.nlu import utilities
 from tests.nlu.conftest import DEFAULT_DATA_PATH, NLU_DEFAULT_CONFIG_PATH
@@ -50,7 +60,32 @@ def loop():
 
 
 @pytest.fixture(scope="session")
-async def pretrained_interpreter(component_builder, tmpdir_factory):
+def pretrained_interpreter():
+    """Fake interpreter with a pretrained-extractor pipeline.
+
+    The tests only inspect the component names and `provides` attributes
+    of the pipeline, so stub components stand in for the real (and
+    expensive to set up) spaCy and Duckling components."""
+
+    class SpacyNLP(Component):
+        provides = ["spacy_doc", "spacy_nlp"]
+
+    class SpacyEntityExtractor(EntityExtractor):
+        provides = ["entities"]
+
+    class DucklingHTTPExtractor(EntityExtractor):
+        provides = ["entities"]
+
+    return Interpreter(
+        [SpacyNLP(), SpacyEntityExtractor(), DucklingHTTPExtractor()], context=None
+    )
+
+
+@pytest.fixture(scope="session")
+async def pretrained_interpreter_full(component_builder, tmpdir_factory):
+    """Real pretrained-extractor pipeline, including the Duckling HTTP
+    extractor setup. Only integration tests should depend on this."""
+
     conf = RasaNLUModelConfig(
         {
             "pipeline": [
@@ -68,25 +103,56 @@ async def pretrained_interpreter(component_builder, tmpdir_factory):
     )
 
 
+def read_json_report(filename):
+    with open(filename, "rb") as f:
+        return json_loads(f.read())
+
+
+TD_CACHE_DIR = ".pytest_cache/td"
+
+
+def load_data_cached(path):
+    """Disk-cached version of `training_data.load_data`.
+
+    The cache key includes the file's mtime, so edits to the data file
+    invalidate the cached copy. Repeated test runs unpickle the parsed
+    training data instead of re-parsing and re-tokenizing the file."""
+
+    key = hashlib.sha1(
+        "{}-{}".format(path, os.path.getmtime(path)).encode("utf-8")
+    ).hexdigest()
+    cache_file = os.path.join(TD_CACHE_DIR, key + ".pkl")
+
+    if os.path.exists(cache_file):
+        with open(cache_file, "rb") as f:
+            return pickle.load(f)
+
+    td = training_data.load_data(path)
+    rasa.utils.io.create_directory(TD_CACHE_DIR)
+    with open(cache_file, "wb") as f:
+        pickle.dump(td, f)
+    return td
+
+
+@pytest.fixture(scope="session")
+def demo_td():
+    return load_data_cached(DEFAULT_DATA_PATH)
+
+
+@pytest.fixture(scope="session")
+def pretrained_embeddings_spacy_config():
+    return config.load("sample_configs/config_pretrained_embeddings_spacy.yml")
+
+
 # Chinese Example
 # "对面食过敏" -> To be allergic to wheat-based food
-CH_wrong_segmentation = [
-    Token("对面", 0),
-    Token("食", 2),
-    Token("过敏", 3),  # opposite, food, allergy
-]
-CH_correct_segmentation = [
-    Token("对", 0),
-    Token("面食", 1),
-    Token("过敏", 3),  # towards, wheat-based food, allergy
-]
 CH_wrong_entity = {"start": 0, "end": 2, "value": "对面", "entity": "direction"}
 CH_correct_entity = {"start": 1, "end": 3, "value": "面食", "entity": "food_type"}
 
 # EN example
 # "Hey Robot, I would like to eat pizza near Alexanderplatz tonight"
-EN_indices = [0, 4, 9, 11, 13, 19, 24, 27, 31, 37, 42, 57]
-EN_tokens = [
+EN_indices = (0, 4, 9, 11, 13, 19, 24, 27, 31, 37, 42, 57)
+EN_token_texts = (
     "Hey",
     "Robot",
     ",",
@@ -99,8 +165,39 @@ EN_tokens = [
     "near",
     "Alexanderplatz",
     "tonight",
-]
-EN_tokens = [Token(t, i) for t, i in zip(EN_tokens, EN_indices)]
+)
+
+EN_starts = np.array(EN_indices, dtype=np.int32)
+EN_lens = np.array([len(t) for t in EN_token_texts], dtype=np.int32)
+
+
+class EntityExtractorA(EntityExtractor):
+
+    provides = ["entities"]
+
+    def __init__(self, component_config=None) -> None:
+
+        super(EntityExtractorA, self).__init__(component_config)
+
+
+class EntityExtractorB(EntityExtractor):
+
+    provides = ["entities"]
+
+    def __init__(self, component_config=None) -> None:
+
+        super(EntityExtractorB, self).__init__(component_config)
+
+
+# `evaluate_entities` only reads the pipeline, so the interpreter can be
+# shared by every test invocation
+MOCK_INTERPRETER = Interpreter(
+    [
+        EntityExtractorA({"provides": ["entities"]}),
+        EntityExtractorB({"provides": ["entities"]}),
+    ],
+    None,
+)
 
 EN_targets = [
     {"start": 31, "end": 36, "value": "pizza", "entity": "food"},
@@ -139,12 +236,41 @@ EN_predicted = [
     },
 ]
 
-EN_entity_result = EntityEvaluationResult(EN_targets, EN_predicted, EN_tokens)
 
-EN_entity_result_no_tokens = EntityEvaluationResult(EN_targets, EN_predicted, [])
+@pytest.fixture(scope="module")
+def CH_wrong_segmentation():
+    return [
+        Token("对面", 0),
+        Token("食", 2),
+        Token("过敏", 3),  # opposite, food, allergy
+    ]
+
+
+@pytest.fixture(scope="module")
+def CH_correct_segmentation():
+    return [
+        Token("对", 0),
+        Token("面食", 1),
+        Token("过敏", 3),  # towards, wheat-based food, allergy
+    ]
+
+
+@pytest.fixture(scope="module")
+def EN_tokens():
+    return [Token(t, i) for t, i in zip(EN_token_texts, EN_indices)]
 
 
-def test_token_entity_intersection():
+@pytest.fixture(scope="module")
+def EN_entity_result(EN_tokens):
+    return EntityEvaluationResult(EN_targets, EN_predicted, EN_tokens)
+
+
+@pytest.fixture(scope="module")
+def EN_entity_result_no_tokens():
+    return EntityEvaluationResult(EN_targets, EN_predicted, [])
+
+
+def test_token_entity_intersection(CH_correct_segmentation):
     # included
     intsec = determine_intersection(CH_correct_segmentation[1], CH_correct_entity)
     assert intsec == len(CH_correct_segmentation[1].text)
@@ -158,7 +284,18 @@ def test_token_entity_intersection():
     assert intsec == 1
 
 
-def test_token_entity_boundaries():
+def test_determine_intersection_batch(EN_tokens):
+    batch = TokenBatch(EN_starts, EN_lens, EN_token_texts)
+
+    intersections = determine_intersection_batch(batch, EN_targets[1])
+
+    assert intersections.tolist() == [0, 0, 0, 0, 0, 0, 0, 0, 0, 4, 14, 0]
+    assert intersections.tolist() == [
+        determine_intersection(t, EN_targets[1]) for t in EN_tokens
+    ]
+
+
+def test_token_entity_boundaries(CH_wrong_segmentation, CH_correct_segmentation):
     # smaller and included
     assert is_token_within_entity(CH_wrong_segmentation[1], CH_correct_entity)
     assert not does_token_cross_borders(CH_wrong_segmentation[1], CH_correct_entity)
@@ -181,7 +318,7 @@ def test_entity_overlap():
     assert not do_entities_overlap(EN_targets)
 
 
-def test_determine_token_labels_throws_error():
+def test_determine_token_labels_throws_error(CH_correct_segmentation):
     with pytest.raises(ValueError):
         determine_token_labels(
             CH_correct_segmentation[0],
@@ -190,18 +327,21 @@ def test_determine_token_labels_throws_error():
         )
 
 
-def test_determine_token_labels_no_extractors():
+def test_determine_token_labels_no_extractors(CH_correct_segmentation):
     with pytest.raises(ValueError):
         determine_token_labels(
             CH_correct_segmentation[0], [CH_correct_entity, CH_wrong_entity], None
         )
 
 
-def test_determine_token_labels_no_extractors_no_overlap():
+def test_determine_token_labels_no_extractors_no_overlap(CH_correct_segmentation):
     determine_token_labels(CH_correct_segmentation[0], EN_targets, None)
 
 
-def test_determine_token_labels_with_extractors():
+def test_determine_token_labels_with_extractors(CH_correct_segmentation):
+    from rasa.nlu.extractors.mitie_entity_extractor import MitieEntityExtractor
+    from rasa.nlu.extractors.spacy_entity_extractor import SpacyEntityExtractor
+
     determine_token_labels(
         CH_correct_segmentation[0],
         [CH_correct_entity, CH_wrong_entity],
@@ -211,32 +351,33 @@ def test_determine_token_labels_with_extractors():
 
 def test_label_merging():
     aligned_predictions = [
-        {
-            "target_labels": ["O", "O"],
-            "extractor_labels": {"EntityExtractorA": ["O", "O"]},
-        },
-        {
-            "target_labels": ["LOC", "O", "O"],
-            "extractor_labels": {"EntityExtractorA": ["O", "O", "O"]},
-        },
+        AlignedPredictions(
+            np.array(["O", "O"]), {"EntityExtractorA": np.array(["O", "O"])}
+        ),
+        AlignedPredictions(
+            np.array(["LOC", "O", "O"]),
+            {"EntityExtractorA": np.array(["O", "O", "O"])},
+        ),
     ]
 
-    assert all(merge_labels(aligned_predictions) == ["O", "O", "LOC", "O", "O"])
-    assert all(
-        merge_labels(aligned_predictions, "EntityExtractorA")
-        == ["O", "O", "O", "O", "O"]
+    assert np.array_equal(
+        merge_labels(aligned_predictions), np.array(["O", "O", "LOC", "O", "O"])
+    )
+    assert np.array_equal(
+        merge_labels(aligned_predictions, "EntityExtractorA"),
+        np.array(["O", "O", "O", "O", "O"]),
     )
 
 
-def test_drop_intents_below_freq():
-    td = training_data.load_data("data/examples/rasa/demo-rasa.json")
-    clean_td = drop_intents_below_freq(td, 0)
+def test_drop_intents_below_freq(demo_td):
+    clean_td = drop_intents_below_freq(demo_td, 0)
     assert clean_td.intents == {"affirm", "goodbye", "greet", "restaurant_search"}
 
-    clean_td = drop_intents_below_freq(td, 10)
+    clean_td = drop_intents_below_freq(demo_td, 10)
     assert clean_td.intents == {"affirm", "restaurant_search"}
 
 
+@utilities.slowtest
 def test_run_evaluation(unpacked_trained_moodbot_path):
     data = DEFAULT_DATA_PATH
 
@@ -247,12 +388,12 @@ def test_run_evaluation(unpacked_trained_moodbot_path):
     assert result.get("entity_evaluation").get("CRFEntityExtractor")
 
 
-def test_run_cv_evaluation():
-    td = training_data.load_data("data/examples/rasa/demo-rasa.json")
-    nlu_config = config.load("sample_configs/config_pretrained_embeddings_spacy.yml")
-
+@utilities.slowtest
+def test_run_cv_evaluation(demo_td, pretrained_embeddings_spacy_config):
     n_folds = 2
-    intent_results, entity_results = cross_validate(td, n_folds, nlu_config)
+    intent_results, entity_results = cross_validate(
+        demo_td, n_folds, pretrained_embeddings_spacy_config, stratified=True
+    )
 
     assert len(intent_results.train["Accuracy"]) == n_folds
     assert len(intent_results.train["Precision"]) == n_folds
@@ -289,7 +430,7 @@ def test_intent_evaluation_report(tmpdir_factory):
         intent_hist_filename=None,
     )
 
-    report = json.loads(rasa.utils.io.read_file(report_filename))
+    report = read_json_report(report_filename)
 
     greet_results = {"precision": 1.0, "recall": 1.0, "f1-score": 1.0, "support": 1}
 
@@ -305,23 +446,7 @@ def test_intent_evaluation_report(tmpdir_factory):
     assert result["predictions"][0] == prediction
 
 
-def test_entity_evaluation_report(tmpdir_factory):
-    class EntityExtractorA(EntityExtractor):
-
-        provides = ["entities"]
-
-        def __init__(self, component_config=None) -> None:
-
-            super(EntityExtractorA, self).__init__(component_config)
-
-    class EntityExtractorB(EntityExtractor):
-
-        provides = ["entities"]
-
-        def __init__(self, component_config=None) -> None:
-
-            super(EntityExtractorB, self).__init__(component_config)
-
+def test_entity_evaluation_report(tmpdir_factory, EN_entity_result):
     path = tmpdir_factory.mktemp("evaluation").strpath
     report_folder = os.path.join(path, "reports")
 
@@ -329,18 +454,11 @@ def test_entity_evaluation_report(tmpdir_factory):
     report_filename_b = os.path.join(report_folder, "EntityExtractorB_report.json")
 
     rasa.utils.io.create_directory(report_folder)
-    mock_interpreter = Interpreter(
-        [
-            EntityExtractorA({"provides": ["entities"]}),
-            EntityExtractorB({"provides": ["entities"]}),
-        ],
-        None,
-    )
-    extractors = get_entity_extractors(mock_interpreter)
+    extractors = get_entity_extractors(MOCK_INTERPRETER)
     result = evaluate_entities([EN_entity_result], extractors, report_folder)
 
-    report_a = json.loads(rasa.utils.io.read_file(report_filename_a))
-    report_b = json.loads(rasa.utils.io.read_file(report_filename_b))
+    report_a = read_json_report(report_filename_a)
+    report_b = read_json_report(report_filename_b)
 
     assert len(report_a) == 8
     assert report_a["datetime"]["support"] == 1.0
@@ -362,66 +480,61 @@ def test_empty_intent_removal():
     assert intent_results[0].message == "hello"
 
 
-def test_evaluate_entities_cv_empty_tokens():
+def test_evaluate_entities_cv_empty_tokens(EN_entity_result_no_tokens):
     mock_extractors = ["EntityExtractorA", "EntityExtractorB"]
     result = align_entity_predictions(EN_entity_result_no_tokens, mock_extractors)
 
-    assert result == {
-        "target_labels": [],
-        "extractor_labels": {"EntityExtractorA": [], "EntityExtractorB": []},
-    }, "Wrong entity prediction alignment"
+    assert result.target_labels.tolist() == [], "Wrong entity prediction alignment"
+    assert result.extractor_labels["EntityExtractorA"].tolist() == []
+    assert result.extractor_labels["EntityExtractorB"].tolist() == []
 
 
-def test_evaluate_entities_cv():
+def test_evaluate_entities_cv(EN_entity_result):
     mock_extractors = ["EntityExtractorA", "EntityExtractorB"]
     result = align_entity_predictions(EN_entity_result, mock_extractors)
 
-    assert result == {
-        "target_labels": [
-            "O",
-            "O",
-            "O",
-            "O",
-            "O",
-            "O",
-            "O",
-            "O",
-            "food",
-            "location",
-            "location",
-            "datetime",
-        ],
-        "extractor_labels": {
-            "EntityExtractorA": [
-                "O",
-                "person",
-                "O",
-                "O",
-                "O",
-                "O",
-                "O",
-                "O",
-                "food",
-                "O",
-                "location",
-                "O",
-            ],
-            "EntityExtractorB": [
-                "O",
-                "O",
-                "O",
-                "O",
-                "O",
-                "O",
-                "O",
-                "O",
-                "O",
-                "O",
-                "movie",
-                "movie",
-            ],
-        },
-    }, "Wrong entity prediction alignment"
+    assert result.target_labels.tolist() == [
+        "O",
+        "O",
+        "O",
+        "O",
+        "O",
+        "O",
+        "O",
+        "O",
+        "food",
+        "location",
+        "location",
+        "datetime",
+    ], "Wrong entity prediction alignment"
+    assert result.extractor_labels["EntityExtractorA"].tolist() == [
+        "O",
+        "person",
+        "O",
+        "O",
+        "O",
+        "O",
+        "O",
+        "O",
+        "food",
+        "O",
+        "location",
+        "O",
+    ], "Wrong entity prediction alignment"
+    assert result.extractor_labels["EntityExtractorB"].tolist() == [
+        "O",
+        "O",
+        "O",
+        "O",
+        "O",
+        "O",
+        "O",
+        "O",
+        "O",
+        "O",
+        "movie",
+        "movie",
+    ], "Wrong entity prediction alignment"
 
 
 def test_get_entity_extractors(pretrained_interpreter):
@@ -431,6 +544,17 @@ def test_get_entity_extractors(pretrained_interpreter):
     }
 
 
+@pytest.mark.skipif(
+    not os.getenv("RASA_INTEGRATION"),
+    reason="requires the duckling server and a spacy model",
+)
+def test_get_entity_extractors_on_real_pipeline(pretrained_interpreter_full):
+    assert get_entity_extractors(pretrained_interpreter_full) == {
+        "SpacyEntityExtractor",
+        "DucklingHTTPExtractor",
+    }
+
+
 def test_remove_pretrained_extractors(pretrained_interpreter):
     target_components_names = ["SpacyNLP"]
     filtered_pipeline = remove_pretrained_extractors(pretrained_interpreter.pipeline)
@@ -444,6 +568,7 @@ def test_label_replacement():
     assert substitute_labels(original_labels, "O", "no_entity") == target_labels
 
 
+@utilities.slowtest
 def test_nlu_comparison(tmpdir):
     configs = [
         NLU_DEFAULT_CONFIG_PATH,